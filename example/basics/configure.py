@@ -1,5 +1,8 @@
 from makepy import (
     Context,
+    Info,
+    Pool,
+    Variant,
     expand,
 )
 from std.cc import ccompile, CCompileArgs
@@ -16,6 +19,7 @@ CONTEXT = Context()
 ROOT_DIR = CONTEXT.variable("ROOT_DIR", str(PARENT_DIR))
 SRC_DIR = CONTEXT.variable("SRC_DIR", expand([ROOT_DIR, "src"], delim="/"))
 INCLUDE_DIR = CONTEXT.variable("LIB_INCLUDE", expand([ROOT_DIR, "includes"], delim="/"))
+BUILD_DIR = CONTEXT.variable("BUILD_DIR", expand([ROOT_DIR, "build"], delim="/"))
 
 CC = CONTEXT.variable("CC", "gcc")
 CFLAGS = CONTEXT.variable("CFLAGS", "-Wall -Wextra -Werror")
@@ -26,18 +30,26 @@ ARFLAGS = CONTEXT.variable("ARFLAGS", "rcs")
 RMFLAGS = CONTEXT.variable("RMFLAGS", "-rf")
 
 
-if __name__ == "__main__":
-    LIB_SOURCE = expand([SRC_DIR, "lib.c"], delim="/")
-    LIB_OUT = expand([SRC_DIR, "lib.o"], delim="/")
-    LIB_AR = expand([SRC_DIR, "lib.a"], delim="/")
+# At most two links run at once, however high -j goes.
+LINK_POOL = Pool(name="link", limit=2)
+
+VARIANTS = {
+    "release": "-O2",
+    "debug": "-O0 -g",
+    "asan": "-O1 -g -fsanitize=address",
+}
 
-    cflags = expand([CFLAGS, "-I", INCLUDE_DIR], delim=" ")
+
+def build(variant: Variant, flags: str) -> Info:
+    cflags = variant.variable(
+        "CFLAGS", expand([CFLAGS, flags, "-I", INCLUDE_DIR], delim=" ")
+    )
 
     lib_objs = ccompile(
-        CONTEXT,
+        variant,
         CCompileArgs(
-            in_=[LIB_SOURCE],
-            out=LIB_OUT,
+            in_=[expand([SRC_DIR, "lib.c"], delim="/")],
+            out=variant.path("lib.o"),
             cc=CC,
             cflags=cflags,
             linking=False,
@@ -45,24 +57,20 @@ if __name__ == "__main__":
     )
 
     lib_archive = archive(
-        CONTEXT,
+        variant,
         ArchiveArgs(
             in_=lib_objs.files,
-            out=LIB_AR,
+            out=variant.path("lib.a"),
             ar=AR,
             arflags=ARFLAGS,
         ),
     )
 
-    BIN_SOURCE = expand([SRC_DIR, "main.c"], delim="/")
-    BIN_OUT = expand([SRC_DIR, "main.o"], delim="/")
-    BIN_BIN = expand([SRC_DIR, "main.exe"], delim="/")
-
     bin_build = ccompile(
-        CONTEXT,
+        variant,
         CCompileArgs(
-            in_=[BIN_SOURCE],
-            out=BIN_OUT,
+            in_=[expand([SRC_DIR, "main.c"], delim="/")],
+            out=variant.path("main.o"),
             cc=CC,
             cflags=cflags,
             linking=False,
@@ -70,26 +78,38 @@ if __name__ == "__main__":
     )
 
     bin = ccompile(
-        CONTEXT,
+        variant,
         CCompileArgs(
-            in_=[BIN_OUT, *lib_archive.files],
-            out=BIN_BIN,
+            in_=[*bin_build.files, *lib_archive.files],
+            out=variant.path("main.exe"),
             cc=CC,
             cflags=cflags,
             linking=True,
+            pool=LINK_POOL,
         ),
     )
 
-    CONTEXT.add_default(bin)
+    variant.add_default(bin)
+    return bin
+
+
+if __name__ == "__main__":
+    # Each variant builds into build/<name>; `make -j debug release asan`
+    # builds them side by side from the one Makefile.
+    bins = {
+        name: build(CONTEXT.variant(name, expand([BUILD_DIR, name], delim="/")), flags)
+        for name, flags in VARIANTS.items()
+    }
+
+    CONTEXT.add_default(bins["release"])
 
     clean = clean(
         CONTEXT,
         CleanArgs(
-            files=[LIB_OUT, BIN_OUT, BIN_BIN, LIB_AR],
+            files=[BUILD_DIR],
             rm=get_rm(CONTEXT),
             rmflags=RMFLAGS,
         ),
     )
 
-with MAKEFILE.open("w") as f:
-    CONTEXT.render(f)
+CONTEXT.render_to(MAKEFILE)
@@ -10,8 +10,9 @@ from makepy import (
     MakeRule,
 )
 from std.bins import get_rm, get_echo
-from std.cc import ccompile, CCompileArgs, ccompile_many, CCompileManyArgs
+from std.cc import ccompile, CCompileArgs
 from std.packaging import archive, ArchiveArgs, clean, CleanArgs
+from std.probe import Prober, CFlag, Header, Function
 from pathlib import Path
 
 
@@ -27,6 +28,18 @@ ALL_FILE = CONTEXT.variable("ALL_FILE", expand([LUA_DIR, "all"], delim="/"))
 
 # == CHANGE THE SETTINGS BELOW TO SUIT YOUR ENVIRONMENT =======================
 
+# Toolchain probes run concurrently and are cached per compiler and environment
+GCC_WARNINGS = ["-Wlogical-op", "-Wno-aggressive-loop-optimizations"]
+PROBES = Prober("gcc", context=CONTEXT).run(
+    [
+        *(CFlag(flag) for flag in GCC_WARNINGS),
+        CFlag("-march=native"),
+        Header("dlfcn.h"),
+        Function("dlopen"),
+        Function("dlopen", ("-ldl",)),
+    ]
+)
+
 # Warnings valid for both C and C++
 CWARNSCPP = CONTEXT.variable(
     "CWARNSCPP",
@@ -51,10 +64,7 @@ CWARNSCPP = CONTEXT.variable(
 CWARNGCC = CONTEXT.variable(
     "CWARNGCC",
     expand(
-        [
-            "-Wlogical-op",
-            "-Wno-aggressive-loop-optimizations",
-        ],
+        [flag for flag in GCC_WARNINGS if PROBES[CFlag(flag)]],
         delim=" ",
     ),
 )
@@ -114,11 +124,14 @@ LOCAL = CONTEXT.variable(
 # To enable Linux goodies, -DLUA_USE_LINUX
 # For C89, "-std=c89 -DLUA_USE_C89"
 # Note that Linux/Posix options are not compatible with C89
+USE_LINUX = PROBES[Header("dlfcn.h")]
 MYCFLAGS = CONTEXT.variable(
-    "MYCFLAGS", expand([LOCAL, "-std=c99", "-DLUA_USE_LINUX"], delim=" ")
+    "MYCFLAGS",
+    expand([LOCAL, "-std=c99", "-DLUA_USE_LINUX" if USE_LINUX else ""], delim=" "),
 )
 MYLDFLAGS = CONTEXT.variable("MYLDFLAGS", "-Wl,-E")
-MYLIBS = CONTEXT.variable("MYLIBS", "-ldl")
+NEEDS_LIBDL = not PROBES[Function("dlopen")] and PROBES[Function("dlopen", ("-ldl",))]
+MYLIBS = CONTEXT.variable("MYLIBS", "-ldl" if NEEDS_LIBDL else "")
 
 ## Binaries
 CC = CONTEXT.variable("CC", "gcc")
@@ -131,7 +144,7 @@ CFLAGS = CONTEXT.variable(
             MYCFLAGS,
             "-fno-stack-protector",
             "-fno-common",
-            "-march=native",
+            "-march=native" if PROBES[CFlag("-march=native")] else "",
         ],
         delim=" ",
     ),
@@ -168,14 +181,9 @@ LUA_O=	lua.o
 
 """
 
-ALL_C_FILES = [p.name for p in LUA_DIR_PATH.glob("*.c")]
-EXPANDED_ALL_C_FILES = [expand([LUA_DIR, c], delim="/") for c in ALL_C_FILES]
-ALL_H_FILES = [p.name for p in LUA_DIR_PATH.glob("*.h")]
+ALL_H_FILES = [Path(p).name for p in CONTEXT.glob(LUA_DIR_PATH, "*.h")]
 EXPANDED_ALL_H_FILES = [expand([LUA_DIR, h], delim="/") for h in ALL_H_FILES]
 
-ALL_O_FILES = [f.replace(".c", ".o") for f in ALL_C_FILES]
-EXPANDED_ALL_O_FILES = [expand([LUA_DIR, o], delim="/") for o in ALL_O_FILES]
-
 CORE_TARGET = CONTEXT.variable("CORE_T", expand([LUA_DIR, "liblua.a"], delim="/"))
 CORE_OBJS = CONTEXT.variable(
     "CORE_OBJS",
@@ -448,16 +456,23 @@ Rule(
 Compile lua:
 """
 
-ccompile_many(
-    CONTEXT,
-    CCompileManyArgs(
-        in_=[*EXPANDED_ALL_C_FILES],
-        out=EXPANDED_ALL_O_FILES,
-        cc=CC,
-        cflags=CFLAGS,
-    ),
-)
+
+# Object rules are generated on demand, only for the objects the requested
+# goals (MAKEPY_GOALS, or default) actually reach.
+def lua_object(context: Context, target: str) -> None:
+    ccompile(
+        context,
+        CCompileArgs(
+            in_=[target.removesuffix(".o") + ".c"],
+            out=target,
+            cc=CC,
+            cflags=CFLAGS,
+            linking=False,
+        ),
+    )
+
+
+CONTEXT.generator(expand([LUA_DIR, "%.o"], delim="/"), lua_object)
 
 ## Render
-with MAKEFILE.open("w") as f:
-    CONTEXT.render(f)
+CONTEXT.render_to(MAKEFILE)
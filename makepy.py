@@ -1,13 +1,37 @@
-from dataclasses import dataclass
+from collections import deque
+from dataclasses import dataclass, field, replace
 from typing import (
+    Callable,
     Protocol,
+    Dict,
+    Iterable,
     List,
+    Optional,
+    Set,
+    Tuple,
     TypeVar,
     Union,
     Generic,
     Sequence,
     TextIO,
 )
+import argparse
+import contextlib
+import importlib.util
+import io
+import fcntl
+import glob
+import os
+import pickle
+import re
+import runpy
+import select
+import site
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
 
 # MAKEPY FRAMEWORK
 
@@ -18,6 +42,10 @@ class Consts:
     NL = "\n"
     WS = " "
     TAB = "\t"
+    MKDIR = "@mkdir -p $(@D)"
+    MAKEPY = "MAKEPY"
+    GOALS = "MAKEPY_GOALS"
+    BUILD_DIR = "build"
 
 
 @dataclass
@@ -37,15 +65,31 @@ def expand(arg: CommandArgs, delim: str = "") -> str:
     return delim.join(part for part in parts if part)
 
 
+@dataclass(frozen=True)
+class Pool:
+    name: str
+    limit: int
+
+    def shell(self, weight: int) -> str:
+        # Used as the rule's SHELL: make passes each expanded recipe line to
+        # the wrapper as a single argument after .SHELLFLAGS (-c).
+        return f"$({Consts.MAKEPY}) pool {self.name} {self.limit} --weight {weight}"
+
+
 @dataclass
 class MakeBaseRule:
     name: str
     dependencies: CommandArgs
     commands: Sequence[str]
+    pool: Optional[Pool] = None
+    weight: int = 1
 
     def emit_into(self, lines: List[str]) -> None:
         expanded = expand(self.dependencies, delim=Consts.WS)
 
+        if self.pool is not None:
+            # private: prerequisites built for this target keep the real shell.
+            lines.append(f"{self.name}: private SHELL = {self.pool.shell(self.weight)}")
         lines.append(f"{self.name}: {expanded}")
         lines.extend(f"{Consts.TAB}{cmd}" for cmd in self.commands)
 
@@ -99,6 +143,48 @@ class DefaultInfo(Info):
     files: Sequence[str] = ()
 
 
+VAR_REF = re.compile(r"\$\$|\$[({]([A-Za-z_][A-Za-z0-9_.-]*)[)}]")
+
+
+def _path_key(word: str) -> str:
+    return os.path.normpath(word)
+
+
+class GraphError(ValueError):
+    pass
+
+
+@dataclass
+class GraphReport:
+    conflicts: List[str]
+    cycles: List[List[str]]
+    missing: List[str]
+
+    def errors(self) -> List[str]:
+        errors = [f"multiple recipes for target {target}" for target in self.conflicts]
+        errors.extend(
+            "dependency cycle " + " -> ".join([*cycle, cycle[0]]) for cycle in self.cycles
+        )
+        return errors
+
+    def warnings(self) -> List[str]:
+        return [f"no rule and no file for prerequisite {path}" for path in self.missing]
+
+
+Generator = Callable[["Context", str], object]
+
+
+def _glob(directory: str, pattern: str) -> List[str]:
+    return sorted(glob.glob(os.path.join(glob.escape(directory), pattern)))
+
+
+@dataclass
+class Inputs:
+    environ: Dict[str, Optional[str]] = field(default_factory=dict)
+    listings: Dict[Tuple[str, str], List[str]] = field(default_factory=dict)
+    files: Set[str] = field(default_factory=set)
+
+
 class Context:
     vars: List[MakeVariable]
     rules: List[MakeBaseRule]
@@ -108,6 +194,23 @@ class Context:
         self.vars = []
         self.rules = []
         self.defaults = []
+        self.variants: List["Variant"] = []
+        self.output: Optional[str] = None
+        self.inputs = Inputs()
+        self.goals: List[str] = (self.env(Consts.GOALS) or "").split()
+
+        self._generators: Dict[str, Tuple[str, Generator]] = {}
+        self._pattern_generators: List[Tuple[str, str, str, Generator]] = []
+
+        self._values: Dict[str, str] = {}
+        self._resolved: Dict[str, str] = {}
+
+        self._indexed = 0
+        self._order: Dict[str, int] = {}
+        self._targets: Dict[str, List[MakeBaseRule]] = {}
+        # Dicts used as ordered sets: membership stays O(1) for huge rules.
+        self._prerequisites: Dict[str, Dict[str, None]] = {}
+        self._dependents: Dict[str, List[str]] = {}
 
     def add_default(self, info: Info) -> None:
         self.defaults.append(info)
@@ -115,30 +218,477 @@ class Context:
     def add_rule(self, rule: MakeBaseRule) -> None:
         self.rules.append(rule)
 
+    ## Recorded configure inputs
+
+    def env(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        value = os.environ.get(name)
+        self.inputs.environ[name] = value
+        return default if value is None else value
+
+    def glob(self, directory: Union[str, "os.PathLike[str]"], pattern: str) -> List[str]:
+        directory = os.path.abspath(directory)
+        paths = _glob(directory, pattern)
+        self.inputs.listings[(directory, pattern)] = paths
+        return paths
+
+    def depend_on(self, path: Union[str, "os.PathLike[str]"]) -> None:
+        self.inputs.files.add(os.path.abspath(path))
+
+    def __getstate__(self) -> Dict[str, object]:
+        # Snapshots keep only what rendering needs: generators have already
+        # been materialized and the index is rebuilt on demand.
+        state = dict(self.__dict__)
+        state["defaults"] = [DefaultInfo(files=list(info.files)) for info in self.defaults]
+        state["_generators"] = {}
+        state["_pattern_generators"] = []
+        state["_resolved"] = {}
+        state["_indexed"] = 0
+        for name in ("_order", "_targets", "_prerequisites", "_dependents"):
+            state[name] = {}
+        return state
+
     def _add_variable(self, var: MakeVariable) -> None:
         self.vars.append(var)
+        self._values[var.name] = str(var.value)
+        self._resolved.clear()
+        self._indexed = 0
 
     def variable(self, name: str, value: str) -> VariableRef:
         self._add_variable(MakeVariable(name=name, value=value))
         return VariableRef(name=name)
 
-    def render(self, writer: TextIO) -> None:
+    ## Variable expansion
+
+    def _resolve_var(self, name: str, active: Set[str]) -> str:
+        cached = self._resolved.get(name)
+        if cached is not None:
+            return cached
+        if name in active:
+            raise ValueError(f"Recursive variable {name} references itself.")
+
+        active.add(name)
+        value = self._substitute(self._values.get(name, ""), active)
+        active.discard(name)
+
+        self._resolved[name] = value
+        return value
+
+    def _substitute(self, text: str, active: Set[str]) -> str:
+        if "$" not in text:
+            return text
+
+        def replace(match: "re.Match[str]") -> str:
+            name = match.group(1)
+            if name is None:
+                return match.group(0)
+            return self._resolve_var(name, active)
+
+        return VAR_REF.sub(replace, text)
+
+    def resolve(self, arg: RefOrStr) -> str:
+        return self._substitute(str(arg), set())
+
+    def words(self, args: CommandArgs) -> List[str]:
+        return [word for arg in args for word in self.resolve(arg).split()]
+
+    ## Target index
+
+    def _index_rule(self, rule: MakeBaseRule) -> None:
+        targets = [_path_key(word) for word in self.words([rule.name])]
+        prerequisites = [_path_key(word) for word in self.words(rule.dependencies)]
+
+        for target in targets:
+            self._order.setdefault(target, len(self._order))
+            self._targets.setdefault(target, []).append(rule)
+
+            known = self._prerequisites.setdefault(target, {})
+            for prerequisite in prerequisites:
+                if prerequisite in known:
+                    continue
+                known[prerequisite] = None
+                self._dependents.setdefault(prerequisite, []).append(target)
+
+    def _update_index(self) -> None:
+        if self._indexed == 0:
+            self._order.clear()
+            self._targets.clear()
+            self._prerequisites.clear()
+            self._dependents.clear()
+
+        for rule in self.rules[self._indexed :]:
+            self._index_rule(rule)
+        self._indexed = len(self.rules)
+
+    def targets(self) -> List[str]:
+        self._update_index()
+        return list(self._targets)
+
+    def rules_for(self, target: str) -> Sequence[MakeBaseRule]:
+        self._update_index()
+        return self._targets.get(_path_key(target), [])
+
+    def prerequisites(self, target: str) -> Sequence[str]:
+        self._update_index()
+        return list(self._prerequisites.get(_path_key(target), ()))
+
+    def dependents(self, prerequisite: str) -> Sequence[str]:
+        self._update_index()
+        return self._dependents.get(_path_key(prerequisite), [])
+
+    def sources(self) -> List[str]:
+        self._update_index()
+        return [path for path in self._dependents if path not in self._targets]
+
+    def affected(self, changed: Iterable[str]) -> List[str]:
+        # Generated rules belong to the graph even when nothing rendered it.
+        self.materialize(self.goals)
+        self._update_index()
+
+        found: Set[str] = set()
+        pending = deque(_path_key(path) for path in changed)
+        while pending:
+            for target in self._dependents.get(pending.popleft(), ()):
+                if target not in found:
+                    found.add(target)
+                    pending.append(target)
+
+        blockers = {
+            target: sum(1 for p in self._prerequisites[target] if p in found)
+            for target in found
+        }
+        ready = deque(
+            sorted(
+                (target for target, count in blockers.items() if count == 0),
+                key=self._order.__getitem__,
+            )
+        )
+
+        ordered: List[str] = []
+        while ready:
+            target = ready.popleft()
+            ordered.append(target)
+            for dependent in self._dependents.get(target, ()):
+                if dependent not in blockers:
+                    continue
+                blockers[dependent] -= 1
+                if blockers[dependent] == 0:
+                    ready.append(dependent)
+
+        if len(ordered) != len(found):
+            raise ValueError("Dependency cycle among affected targets.")
+        return ordered
+
+    ## Lazy rules
+
+    def generator(self, pattern: RefOrStr, generate: Generator) -> None:
+        # Generators get the target in the pattern's own $(VAR) form, so the
+        # rules they add keep honouring make-time overrides.
+        original = str(pattern)
+        resolved = _path_key(self.resolve(pattern))
+        if "%" in resolved:
+            prefix, _, suffix = resolved.partition("%")
+            self._pattern_generators.append((prefix, suffix, original, generate))
+        else:
+            self._generators[resolved] = (original, generate)
+
+    def _find_generator(self, target: str) -> Optional[Tuple[str, Generator]]:
+        found = self._generators.get(target)
+        if found is not None:
+            return found
+
+        for prefix, suffix, original, generate in self._pattern_generators:
+            if (
+                len(target) >= len(prefix) + len(suffix)
+                and target.startswith(prefix)
+                and target.endswith(suffix)
+            ):
+                if "%" not in original:
+                    return target, generate
+                stem = target[len(prefix) : len(target) - len(suffix)]
+                return original.replace("%", stem, 1), generate
+        return None
+
+    def _goal_files(self) -> List[str]:
+        return [
+            *self._default_files(),
+            *(file for variant in self.variants for file in variant._default_files()),
+        ]
+
+    def materialize(self, goals: Optional[CommandArgs] = None) -> None:
+        if not self._generators and not self._pattern_generators:
+            return
+
+        wanted = self.words(goals if goals else self._goal_files())
+        pending = deque(_path_key(goal) for goal in wanted)
+        seen: Set[str] = set()
+        while pending:
+            target = pending.popleft()
+            if target in seen:
+                continue
+            seen.add(target)
+
+            self._update_index()
+            if not any(rule.commands for rule in self._targets.get(target, ())):
+                found = self._find_generator(target)
+                if found is not None:
+                    name, generate = found
+                    generate(self, name)
+                    self._update_index()
+
+            pending.extend(self._prerequisites.get(target, ()))
+
+    ## Validation
+
+    def _conflicts(self) -> List[str]:
+        # Rules with a recipe are only merged when they are written for the
+        # same target text with the same recipe, pool and weight; anything
+        # else would reach make as two recipes for one target.
+        conflicts: List[str] = []
+        for target, rules in self._targets.items():
+            recipes = {
+                (type(rule), str(rule.name), tuple(map(str, rule.commands)), rule.pool, rule.weight)
+                for rule in rules
+                if rule.commands
+            }
+            if len(recipes) > 1:
+                conflicts.append(target)
+        return conflicts
+
+    def _cycles(self) -> List[List[str]]:
+        # Iterative three-colour DFS: linear in rules plus prerequisites.
+        done: Set[str] = set()
+        on_stack: Dict[str, int] = {}
+        cycles: List[List[str]] = []
+
+        for root in self._targets:
+            if root in done:
+                continue
+
+            path = [root]
+            on_stack[root] = 0
+            stack = [iter(self._prerequisites[root])]
+            while stack:
+                child = next(stack[-1], None)
+                if child is None:
+                    stack.pop()
+                    node = path.pop()
+                    del on_stack[node]
+                    done.add(node)
+                elif child in on_stack:
+                    cycles.append(path[on_stack[child] :])
+                elif child not in done and child in self._prerequisites:
+                    on_stack[child] = len(path)
+                    path.append(child)
+                    stack.append(iter(self._prerequisites[child]))
+        return cycles
+
+    def _missing(self) -> List[str]:
+        listings: Dict[str, Set[str]] = {}
+
+        def exists(path: str) -> bool:
+            directory, name = os.path.split(path)
+            names = listings.get(directory)
+            if names is None:
+                try:
+                    names = set(os.listdir(directory or os.curdir))
+                except OSError:
+                    names = set()
+                listings[directory] = names
+            return name in names
+
+        goals = map(_path_key, self.words(self._goal_files()))
+        candidates = [*self.sources(), *goals]
+        output = _path_key(self.output) if self.output else None
+
+        missing: List[str] = []
+        for path in dict.fromkeys(candidates):
+            if path in self._targets or path == output or exists(path):
+                continue
+            missing.append(path)
+        return missing
+
+    def check(self) -> GraphReport:
+        self.materialize(self.goals)
+        self._update_index()
+        return GraphReport(
+            conflicts=self._conflicts(),
+            cycles=self._cycles(),
+            missing=self._missing(),
+        )
+
+    def validate(self) -> None:
+        report = self.check()
+        for warning in report.warnings():
+            print(f"warning: {warning}", file=sys.stderr)
+
+        errors = report.errors()
+        if errors:
+            raise GraphError("Invalid build graph:\n  " + "\n  ".join(errors))
+
+    ## Rendering
+
+    def _default_files(self) -> List[str]:
+        return [file for info in self.defaults for file in info.files]
+
+    def _merged_rules(self) -> List[MakeBaseRule]:
+        # Rules for the same target are emitted as one, with the union of
+        # their prerequisites and the single recipe validation allowed.
+        merged: Dict[Tuple[type, str], MakeBaseRule] = {}
+        for rule in self.rules:
+            key = (type(rule), str(rule.name))
+            first = merged.get(key)
+            if first is None:
+                merged[key] = rule
+                continue
+            dependencies = [*first.dependencies, *rule.dependencies]
+            recipe = first if first.commands else rule
+            merged[key] = replace(
+                recipe, dependencies=list(dict.fromkeys(map(str, dependencies)))
+            )
+        return list(merged.values())
+
+    def render(self, writer: TextIO, validate: bool = True) -> None:
+        self.materialize(self.goals)
+        if validate:
+            self.validate()
+
         for var in self.vars:
             writer.write(_nl(var.emit(), 1))
+        if any(rule.pool for rule in self.rules):
+            runner = command([sys.executable, os.path.abspath(__file__)])
+            writer.write(_nl(MakeVariable(name=Consts.MAKEPY, value=runner).emit(), 1))
         writer.write(_nl("", 1))
 
         default = MakePhonyRule(
             name=Consts.DEFAULT,
-            dependencies=[file for info in self.defaults for file in info.files],
+            dependencies=self._default_files(),
             commands=[],
         )
         writer.write(_nl(default.emit(), 2))
 
-        for rule in self.rules:
+        for variant in self.variants:
+            goal = MakePhonyRule(
+                name=variant.name,
+                dependencies=variant._default_files(),
+                commands=[],
+            )
+            writer.write(_nl(goal.emit(), 2))
+
+        for rule in self._merged_rules():
             writer.write(_nl(rule.emit(), 1))
 
         writer.write(_nl("", 1))
 
+    def render_to(self, path: Union[str, "os.PathLike[str]"]) -> bool:
+        self.output = os.fspath(path)
+
+        buffer = io.StringIO()
+        self.render(buffer)
+        text = buffer.getvalue()
+
+        # Leave an unchanged Makefile untouched so make sees no new mtime.
+        try:
+            with open(path) as f:
+                if f.read() == text:
+                    return False
+        except OSError:
+            pass
+
+        with open(path, "w") as f:
+            f.write(text)
+        return True
+
+    def variant(self, name: str, build_dir: Optional[RefOrStr] = None) -> "Variant":
+        variant = Variant(self, name, build_dir or f"{Consts.BUILD_DIR}/{name}")
+        self.variants.append(variant)
+        return variant
+
+
+# A variant prefixes its variables and forwards its rules to the parent, so all
+# variants render into one Makefile and build side by side through the phony
+# target named after the variant. Rules added to the parent are shared. Only
+# its default files are its own: queries, inputs and rendering all go to the
+# parent's graph.
+class Variant(Context):
+    def __init__(self, parent: Context, name: str, build_dir: RefOrStr):
+        self.parent = parent
+        self.defaults = []
+        self.name = name
+        self.prefix = re.sub(r"[^A-Za-z0-9]", "_", name).upper()
+        self.build_dir = self.variable("BUILD_DIR", str(build_dir))
+
+    def __getstate__(self) -> Dict[str, object]:
+        state = dict(self.__dict__)
+        state["defaults"] = [DefaultInfo(files=list(info.files)) for info in self.defaults]
+        return state
+
+    def path(self, *parts: RefOrStr) -> str:
+        return expand([self.build_dir, *parts], delim="/")
+
+    def add_rule(self, rule: MakeBaseRule) -> None:
+        if rule.commands and rule.commands[0] != Consts.MKDIR:
+            rule = replace(rule, commands=[Consts.MKDIR, *rule.commands])
+        self.parent.add_rule(rule)
+
+    def variable(self, name: str, value: str) -> VariableRef:
+        scoped = f"{self.prefix}_{name}"
+        self.parent._add_variable(MakeVariable(name=scoped, value=value))
+        return VariableRef(name=scoped)
+
+    def generator(self, pattern: RefOrStr, generate: Generator) -> None:
+        self.parent.generator(pattern, lambda _, target: generate(self, target))
+
+    def env(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        return self.parent.env(name, default)
+
+    def glob(self, directory: Union[str, "os.PathLike[str]"], pattern: str) -> List[str]:
+        return self.parent.glob(directory, pattern)
+
+    def depend_on(self, path: Union[str, "os.PathLike[str]"]) -> None:
+        self.parent.depend_on(path)
+
+    def resolve(self, arg: RefOrStr) -> str:
+        return self.parent.resolve(arg)
+
+    def words(self, args: CommandArgs) -> List[str]:
+        return self.parent.words(args)
+
+    def targets(self) -> List[str]:
+        return self.parent.targets()
+
+    def rules_for(self, target: str) -> Sequence[MakeBaseRule]:
+        return self.parent.rules_for(target)
+
+    def prerequisites(self, target: str) -> Sequence[str]:
+        return self.parent.prerequisites(target)
+
+    def dependents(self, prerequisite: str) -> Sequence[str]:
+        return self.parent.dependents(prerequisite)
+
+    def sources(self) -> List[str]:
+        return self.parent.sources()
+
+    def affected(self, changed: Iterable[str]) -> List[str]:
+        return self.parent.affected(changed)
+
+    def materialize(self, goals: Optional[CommandArgs] = None) -> None:
+        self.parent.materialize(goals)
+
+    def check(self) -> GraphReport:
+        return self.parent.check()
+
+    def validate(self) -> None:
+        self.parent.validate()
+
+    def render(self, writer: TextIO, validate: bool = True) -> None:
+        self.parent.render(writer, validate)
+
+    def render_to(self, path: Union[str, "os.PathLike[str]"]) -> bool:
+        return self.parent.render_to(path)
+
+    def variant(self, name: str, build_dir: Optional[RefOrStr] = None) -> "Variant":
+        return self.parent.variant(name, build_dir)
+
 
 RuleArgs = TypeVar("RuleArgs")
 
@@ -160,3 +710,442 @@ class Rule(Generic[RuleArgs, RuleInfo]):
         description = self.describe_impl(args)
         print(description)
         return self.impl(context, args)
+
+
+# MAKEPY CLI
+
+
+def load_context(module: str, name: str = "CONTEXT") -> Context:
+    # Configure scripts announce every rule on stdout; keep it free for results.
+    with contextlib.redirect_stdout(sys.stderr):
+        scope = runpy.run_module(module, run_name="__main__")
+
+    context = scope.get(name)
+    if not isinstance(context, Context):
+        raise ValueError(f"{module} does not define a Context named {name}.")
+    return context
+
+
+def affected_main(args: argparse.Namespace) -> int:
+    context = load_context(args.module, args.context)
+
+    files: Iterable[str] = args.files or (line.strip() for line in sys.stdin)
+    changed = [path for file in files if file for path in (file, os.path.abspath(file))]
+
+    for target in context.affected(changed):
+        print(target)
+    return 0
+
+
+Stat = Optional[Tuple[int, int]]
+
+
+def _stat(path: str) -> Stat:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _installed_dirs() -> Tuple[str, ...]:
+    dirs = {sys.prefix, sys.exec_prefix, sys.base_prefix, *site.getsitepackages()}
+    dirs.add(site.getusersitepackages())
+    return tuple(os.path.abspath(path) + os.sep for path in dirs)
+
+
+def _project_modules(root: str) -> Dict[str, str]:
+    # Installed packages are not project code even when the environment lives
+    # in the project (./venv): they are neither re-imported nor fingerprinted.
+    installed = _installed_dirs()
+    modules: Dict[str, str] = {}
+    for name, module in list(sys.modules.items()):
+        file = getattr(module, "__file__", None)
+        if not file:
+            continue
+        path = os.path.abspath(file)
+        if (
+            not path.startswith(root + os.sep)
+            or path.startswith(installed)
+            or f"{os.sep}site-packages{os.sep}" in path
+        ):
+            continue
+        modules[name] = path
+    return modules
+
+
+class Change:
+    NONE = ""
+    RESTART = "restart"
+    CONFIGURE = "configure"
+    BUILD = "build"
+
+
+class Watcher:
+    def __init__(self, module: str, name: str) -> None:
+        self.module = module
+        self.name = name
+        self.root = os.getcwd()
+        self.framework = os.path.abspath(__file__)
+        self.library = os.path.join(os.path.dirname(self.framework), "std") + os.sep
+
+        self.context: Optional[Context] = None
+        self.framework_stat = _stat(self.framework)
+        self.modules: Dict[str, Stat] = {}
+        self.sources: Dict[str, Stat] = {}
+        self.directories: Dict[str, Stat] = {}
+        self.listings: Dict[str, Set[str]] = {}
+
+    def _project_modules(self) -> Dict[str, str]:
+        modules = _project_modules(self.root)
+        return {name: path for name, path in modules.items() if path != self.framework}
+
+    def _listing(self, directory: str) -> Set[str]:
+        assert self.context is not None
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return set()
+
+        # Outputs appearing during a build must not trigger a reconfigure.
+        output = _path_key(self.context.output) if self.context.output else None
+        return {
+            name
+            for name in names
+            if not self.context.rules_for(os.path.join(directory, name))
+            and _path_key(os.path.join(directory, name)) != output
+        }
+
+    def _track_modules(self) -> None:
+        # Keep watching modules from the previous run too: one that failed to
+        # import is missing from sys.modules but must still trigger a retry.
+        spec = importlib.util.find_spec(self.module)
+        scripts = {*self.modules, *self._project_modules().values()}
+        if spec is not None and spec.origin:
+            scripts.add(os.path.abspath(spec.origin))
+        self.modules = {path: _stat(path) for path in scripts}
+
+    def _track(self, context: Context) -> None:
+        self.context = context
+
+        self.sources = {path: _stat(path) for path in context.sources()}
+        directories = {os.path.dirname(path) or os.curdir for path in self.sources}
+        self.directories = {path: _stat(path) for path in directories}
+        self.listings = {path: self._listing(path) for path in directories}
+
+    def configure(self) -> bool:
+        # Drop project modules so edited configure helpers are re-imported;
+        # makepy and std stay warm unless a std module itself was edited.
+        for name, path in self._project_modules().items():
+            if path.startswith(self.library) and _stat(path) == self.modules.get(path):
+                continue
+            del sys.modules[name]
+
+        previous = self.context
+        try:
+            context = load_context(self.module, self.name)
+        except Exception:
+            traceback.print_exc()
+            return False
+        finally:
+            self._track_modules()
+        self._track(context)
+
+        def emitted(configured: Context) -> Set[str]:
+            return {item.emit() for item in [*configured.vars, *configured.rules]}
+
+        before = emitted(previous) if previous else set()
+        after = emitted(context)
+        print(
+            f"makepy: configured {len(context.rules)} rules and {len(context.vars)}"
+            f" variables, {len(before ^ after)} changed",
+            file=sys.stderr,
+        )
+        return True
+
+    def poll(self) -> str:
+        if _stat(self.framework) != self.framework_stat:
+            return Change.RESTART
+
+        for path, stat in self.modules.items():
+            if _stat(path) != stat:
+                return Change.CONFIGURE
+
+        for path, stat in self.directories.items():
+            current = _stat(path)
+            if current == stat:
+                continue
+            self.directories[path] = current
+            if self._listing(path) != self.listings[path]:
+                return Change.CONFIGURE
+
+        change = Change.NONE
+        for path, stat in self.sources.items():
+            current = _stat(path)
+            if current != stat:
+                self.sources[path] = current
+                change = Change.BUILD
+        return change
+
+    def build(self, jobs: Optional[int]) -> int:
+        cmd = ["make"]
+        if self.context is not None and self.context.output:
+            cmd.extend(["-f", self.context.output])
+        if jobs:
+            cmd.append(f"-j{jobs}")
+        return subprocess.call(cmd)
+
+
+def watch_main(args: argparse.Namespace) -> int:
+    watcher = Watcher(args.module, args.context)
+    if watcher.configure() and args.build:
+        watcher.build(args.jobs)
+
+    try:
+        while True:
+            time.sleep(args.interval)
+            change = watcher.poll()
+            if change == Change.RESTART:
+                os.execv(sys.executable, [sys.executable, "-m", "makepy", *sys.argv[1:]])
+            if change == Change.CONFIGURE and not watcher.configure():
+                continue
+            if change != Change.NONE and args.build:
+                watcher.build(args.jobs)
+    except KeyboardInterrupt:
+        return 0
+
+
+@dataclass
+class Fingerprint:
+    python: str
+    files: Dict[str, Stat]
+    environ: Dict[str, Optional[str]]
+    listings: Dict[Tuple[str, str], List[str]]
+    output: Optional[str]
+    output_stat: Stat
+
+    @classmethod
+    def collect(cls, module: str, context: Context) -> "Fingerprint":
+        files = set(_project_modules(os.getcwd()).values()) | context.inputs.files
+        spec = importlib.util.find_spec(module)
+        if spec is not None and spec.origin:
+            files.add(os.path.abspath(spec.origin))
+
+        return cls(
+            python=sys.executable,
+            files={path: _stat(path) for path in sorted(files)},
+            environ=dict(context.inputs.environ),
+            listings=dict(context.inputs.listings),
+            output=context.output,
+            output_stat=_stat(context.output) if context.output else None,
+        )
+
+    def inputs_unchanged(self) -> bool:
+        return (
+            self.python == sys.executable
+            and all(_stat(path) == stat for path, stat in self.files.items())
+            and all(os.environ.get(name) == value for name, value in self.environ.items())
+            and all(_glob(*key) == paths for key, paths in self.listings.items())
+        )
+
+    def output_unchanged(self) -> bool:
+        return self.output is not None and _stat(self.output) == self.output_stat
+
+
+def save_snapshot(path: str, fingerprint: Fingerprint, context: Context) -> None:
+    os.makedirs(os.path.dirname(path) or os.curdir, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}"
+    try:
+        with open(tmp, "wb") as f:
+            # The fingerprint comes first so a fresh check never unpickles the
+            # Context itself.
+            pickle.dump(fingerprint, f, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(context, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except (pickle.PicklingError, AttributeError, TypeError) as error:
+        # Classes and lambdas defined by the configure script live in
+        # __main__ and cannot be pickled; such scripts just run every time.
+        print(f"makepy: not saving a snapshot: {error}", file=sys.stderr)
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(path)
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp)
+
+
+def configure_main(args: argparse.Namespace) -> int:
+    snapshot = args.snapshot or os.path.join(".makepy", f"{args.module}.snapshot")
+
+    if not args.force:
+        try:
+            with open(snapshot, "rb") as f:
+                fingerprint: Fingerprint = pickle.load(f)
+                if fingerprint.inputs_unchanged():
+                    if fingerprint.output_unchanged():
+                        print(f"makepy: {args.module} is up to date", file=sys.stderr)
+                        return 0
+
+                    context: Context = pickle.load(f)
+                    if context.output is not None:
+                        context.render_to(context.output)
+                        fingerprint.output_stat = _stat(context.output)
+                        save_snapshot(snapshot, fingerprint, context)
+                        print(f"makepy: {args.module} rendered from snapshot", file=sys.stderr)
+                        return 0
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            pass
+
+    context = load_context(args.module, args.context)
+    save_snapshot(snapshot, Fingerprint.collect(args.module, context), context)
+    return 0
+
+
+class Jobserver:
+    # While a pooled step waits for its slots it hands its own job slot back
+    # to make, so other recipes keep running, and takes one back before
+    # running. Only possible when make exposes the jobserver to recipes.
+    def __init__(self) -> None:
+        self.fds: Optional[Tuple[int, int]] = None
+        self.lent = False
+
+        match = re.search(r"--jobserver-(?:auth|fds)=(\S+)", os.environ.get("MAKEFLAGS", ""))
+        if match is None:
+            return
+        try:
+            auth = match.group(1)
+            if auth.startswith("fifo:"):
+                fd = os.open(auth[len("fifo:") :], os.O_RDWR)
+                self.fds = (fd, fd)
+            else:
+                read, write = (int(fd) for fd in auth.split(","))
+                os.fstat(read)
+                os.fstat(write)
+                self.fds = (read, write)
+        except (OSError, ValueError):
+            self.fds = None
+
+    def lend(self) -> None:
+        if self.fds is None or self.lent:
+            return
+        os.write(self.fds[1], b"+")
+        self.lent = True
+
+    def reclaim(self) -> None:
+        if self.fds is None or not self.lent:
+            return
+        while True:
+            select.select([self.fds[0]], [], [])
+            try:
+                if os.read(self.fds[0], 1):
+                    break
+            except BlockingIOError:
+                continue
+        self.lent = False
+
+
+def _acquire_slots(directory: str, pool: str, limit: int, weight: int) -> List[int]:
+    os.makedirs(directory, exist_ok=True)
+    paths = [os.path.join(directory, f"{pool}.{slot}.lock") for slot in range(limit)]
+    weight = max(1, min(weight, limit))
+
+    held: List[int] = []
+    for path in paths:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            continue
+        held.append(fd)
+        if len(held) == weight:
+            return held
+
+    # Never sit on a partial set: a heavier step could deadlock lighter ones.
+    for fd in held:
+        os.close(fd)
+    return []
+
+
+def pool_main(args: argparse.Namespace) -> int:
+    jobserver = Jobserver()
+    delay = 0.01
+    try:
+        while True:
+            slots = _acquire_slots(args.dir, args.name, args.limit, args.weight)
+            if slots:
+                break
+            jobserver.lend()
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+    finally:
+        jobserver.reclaim()
+
+    try:
+        return subprocess.call(["/bin/sh", "-c", args.command])
+    finally:
+        for fd in slots:
+            os.close(fd)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="makepy")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    affected = commands.add_parser(
+        "affected",
+        help="print every target affected by the changed files, in build order",
+    )
+    affected.add_argument("module", help="configure module, e.g. example.lua.configure")
+    affected.add_argument("files", nargs="*", help="changed files (default: stdin)")
+    affected.add_argument("--context", default="CONTEXT", help="Context variable name")
+    affected.set_defaults(run=affected_main)
+
+    watch = commands.add_parser(
+        "watch",
+        help="keep the configured Context in memory and regenerate on changes",
+    )
+    watch.add_argument("module", help="configure module, e.g. example.lua.configure")
+    watch.add_argument("--context", default="CONTEXT", help="Context variable name")
+    watch.add_argument("--build", action="store_true", help="run make after changes")
+    watch.add_argument("-j", "--jobs", type=int, help="jobs passed to make")
+    watch.add_argument("--interval", type=float, default=0.25, help="poll seconds")
+    watch.set_defaults(run=watch_main)
+
+    configure = commands.add_parser(
+        "configure",
+        help="run a configure module, or reuse its snapshot when inputs are unchanged",
+    )
+    configure.add_argument("module", help="configure module, e.g. example.lua.configure")
+    configure.add_argument("--context", default="CONTEXT", help="Context variable name")
+    configure.add_argument("--snapshot", help="snapshot file (default: .makepy/<module>)")
+    configure.add_argument("--force", action="store_true", help="ignore the snapshot")
+    configure.set_defaults(run=configure_main)
+
+    pool = commands.add_parser(
+        "pool",
+        help="run a recipe line once slots in a resource pool are free",
+    )
+    pool.add_argument("name", help="pool name")
+    pool.add_argument("limit", type=int, help="slots in the pool")
+    pool.add_argument("--weight", type=int, default=1, help="slots this step holds")
+    pool.add_argument(
+        "--dir",
+        default=os.environ.get(
+            "MAKEPY_POOL_DIR",
+            os.path.join(tempfile.gettempdir(), f"makepy-pools-{os.getuid()}"),
+        ),
+        help="directory holding the slot locks",
+    )
+    pool.add_argument(
+        "-c", dest="command", required=True, help="recipe line, as make passes it"
+    )
+    pool.set_defaults(run=pool_main)
+
+    args = parser.parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    import makepy
+
+    sys.exit(makepy.main())
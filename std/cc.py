@@ -1,19 +1,27 @@
 from makepy import (
+    Consts as MakeConsts,
     DefaultInfo,
     RefOrStr,
     Context,
     Info,
     MakeRule,
+    Pool,
     Rule,
     command,
 )
 from dataclasses import dataclass
-from typing import Sequence
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import hashlib
+import os
+import re
 
 
 class Consts:
     OUTPUT = "-o"
     CMODE = "-c"
+    RELOCATABLE = "-r"
+    OBJECT = ".o"
+    PARTS = ".parts"
 
 
 ## Compile a single C file
@@ -24,8 +32,10 @@ class CCompileArgs:
     in_: Sequence[str]
     out: str
     cc: RefOrStr
-    cflags: str
+    cflags: RefOrStr
     linking: bool
+    pool: Optional[Pool] = None
+    weight: int = 1
 
 
 def ccompile_impl(context: Context, args: CCompileArgs) -> Info:
@@ -46,6 +56,8 @@ def ccompile_impl(context: Context, args: CCompileArgs) -> Info:
         name=args.out,
         dependencies=args.in_,
         commands=[cmd],
+        pool=args.pool,
+        weight=args.weight,
     )
     context.add_rule(rule)
     return DefaultInfo(files=[args.out])
@@ -103,3 +115,113 @@ ccompile_many = Rule(
     impl=ccompile_many_impl,
     describe_impl=ccompile_many_impl_describe,
 )
+
+## Link objects through per-group partial links
+
+
+@dataclass
+class CLinkGroupedArgs:
+    in_: Sequence[RefOrStr]
+    out: str
+    cc: RefOrStr
+    cflags: RefOrStr
+    ld: RefOrStr
+    group: Callable[[str], str] = os.path.dirname
+    group_size: int = 0
+    pool: Optional[Pool] = None
+    weight: int = 1
+
+
+@dataclass
+class _Group:
+    members: List[str]
+    count: int = 0
+
+
+def _group_inputs(
+    context: Context, args: CLinkGroupedArgs
+) -> Tuple[Dict[str, _Group], List[str]]:
+    # Keep inputs in their original $(VAR) form so the Makefile still honours
+    # overrides; an input is only split into its expanded objects when they
+    # fall into different groups.
+    groups: Dict[str, _Group] = {}
+    others: List[str] = []
+
+    def add(key: str, member: str, count: int) -> None:
+        group = groups.setdefault(key, _Group(members=[]))
+        group.members.append(member)
+        group.count += count
+
+    for arg in args.in_:
+        words = context.words([arg])
+        objects = [word for word in words if word.endswith(Consts.OBJECT)]
+        keys = {args.group(word) for word in objects}
+        if not objects:
+            others.append(str(arg))
+        elif len(objects) == len(words) and len(keys) == 1:
+            add(keys.pop(), str(arg), len(objects))
+        else:
+            for word in words:
+                if word.endswith(Consts.OBJECT):
+                    add(args.group(word), word, 1)
+                else:
+                    others.append(word)
+
+    if args.group_size <= 0:
+        return groups, others
+
+    chunked: Dict[str, _Group] = {}
+    for key, group in groups.items():
+        chunks = [_Group(members=[])]
+        for member in group.members:
+            if chunks[-1].count >= args.group_size:
+                chunks.append(_Group(members=[]))
+            chunks[-1].members.append(member)
+            chunks[-1].count += len(context.words([member]))
+        for index, chunk in enumerate(chunks):
+            chunked[f"{key}-{index}"] = chunk
+    return chunked, others
+
+
+def clink_grouped_impl(context: Context, args: CLinkGroupedArgs) -> Info:
+    groups, others = _group_inputs(context, args)
+
+    parts: List[str] = []
+    for key, group in groups.items():
+        # Named by the group key, not its position, so adding a group leaves
+        # the other parts and their timestamps alone.
+        slug = re.sub(r"[^A-Za-z0-9_.-]", "_", os.path.basename(key)) or "root"
+        digest = hashlib.sha1(key.encode()).hexdigest()[:10]
+        part = f"{args.out}{Consts.PARTS}/{slug}-{digest}{Consts.OBJECT}"
+
+        cmd = command([args.ld, Consts.RELOCATABLE, Consts.OUTPUT, part, *group.members])
+        context.add_rule(
+            MakeRule(
+                name=part,
+                dependencies=group.members,
+                commands=[MakeConsts.MKDIR, cmd],
+            )
+        )
+        parts.append(part)
+
+    # Archives and other non-object inputs go to the final link untouched.
+    cmd = command([args.cc, args.cflags, *parts, *others, Consts.OUTPUT, args.out])
+    rule = MakeRule(
+        name=args.out,
+        dependencies=[*parts, *others],
+        commands=[cmd],
+        pool=args.pool,
+        weight=args.weight,
+    )
+    context.add_rule(rule)
+    return DefaultInfo(files=[args.out])
+
+
+def clink_grouped_impl_describe(args: CLinkGroupedArgs) -> str:
+    return f"Generating grouped partial-link rules for {args.out}"
+
+
+clink_grouped = Rule(
+    impl=clink_grouped_impl,
+    describe_impl=clink_grouped_impl_describe,
+)
@@ -7,9 +7,10 @@ from makepy import (
     command,
     DefaultInfo,
     MakePhonyRule,
+    Pool,
 )
 from dataclasses import dataclass
-from typing import Sequence
+from typing import Optional, Sequence
 
 
 ## Archive objects into a static library
@@ -19,6 +20,8 @@ class ArchiveArgs:
     out: str
     ar: RefOrStr
     arflags: RefOrStr
+    pool: Optional[Pool] = None
+    weight: int = 1
 
 
 @dataclass
@@ -34,6 +37,8 @@ def archive_impl(context: Context, args: ArchiveArgs) -> ArchiveInfo:
         name=args.out,
         dependencies=args.in_,
         commands=[cmd],
+        pool=args.pool,
+        weight=args.weight,
     )
     context.add_rule(rule)
 
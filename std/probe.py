@@ -0,0 +1,187 @@
+from makepy import Context
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+import hashlib
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+
+
+class Consts:
+    CACHE = ".makepy/probes.json"
+    # Bumped when probes change how they run, so stale cached results are
+    # not reused.
+    VERSION = 2
+    SOURCE = "probe.c"
+    OUTPUT = "probe.out"
+    EMPTY_MAIN = "int main(void) { return 0; }\n"
+    # Environment that changes what the compiler finds or accepts.
+    ENVIRON = (
+        "PATH",
+        "CPATH",
+        "C_INCLUDE_PATH",
+        "LIBRARY_PATH",
+        "GCC_EXEC_PREFIX",
+        "COMPILER_PATH",
+    )
+
+
+Result = Union[bool, str]
+
+
+def _compiles(
+    cc: Sequence[str], source: str, args: Sequence[str], libs: Sequence[str] = ()
+) -> bool:
+    with tempfile.TemporaryDirectory(prefix="makepy-probe-") as tmp:
+        src = Path(tmp) / Consts.SOURCE
+        src.write_text(source)
+        # Libraries go after the source: an as-needed linker drops libraries
+        # that come before the objects using them.
+        cmd = [*cc, *args, str(src), *libs, "-o", str(Path(tmp) / Consts.OUTPUT)]
+        try:
+            done = subprocess.run(cmd, capture_output=True)
+        except OSError:
+            return False
+        return done.returncode == 0
+
+
+## Probes
+
+
+@dataclass(frozen=True)
+class CFlag:
+    flag: str
+
+    def key(self) -> str:
+        return f"cflag:{self.flag}"
+
+    def run(self, cc: Sequence[str]) -> Result:
+        return _compiles(cc, Consts.EMPTY_MAIN, ["-Werror", self.flag, "-c"])
+
+
+@dataclass(frozen=True)
+class Header:
+    name: str
+
+    def key(self) -> str:
+        return f"header:{self.name}"
+
+    def run(self, cc: Sequence[str]) -> Result:
+        source = f"#include <{self.name}>\n{Consts.EMPTY_MAIN}"
+        return _compiles(cc, source, ["-c"])
+
+
+@dataclass(frozen=True)
+class Function:
+    name: str
+    libs: Tuple[str, ...] = ()
+
+    def key(self) -> str:
+        return f"function:{self.name}:{' '.join(self.libs)}"
+
+    def run(self, cc: Sequence[str]) -> Result:
+        source = f"char {self.name}(void);\nint main(void) {{ return (int){self.name}(); }}\n"
+        return _compiles(cc, source, [], self.libs)
+
+
+@dataclass(frozen=True)
+class Version:
+    def key(self) -> str:
+        return "version"
+
+    def run(self, cc: Sequence[str]) -> Result:
+        try:
+            done = subprocess.run([*cc, "--version"], capture_output=True, text=True)
+        except OSError:
+            return ""
+        return done.stdout.partition("\n")[0].strip()
+
+
+Probe = Union[CFlag, Header, Function, Version]
+
+
+## Prober
+
+
+class Prober:
+    def __init__(
+        self,
+        cc: str,
+        cache: Optional[str] = Consts.CACHE,
+        jobs: Optional[int] = None,
+        context: Optional[Context] = None,
+    ):
+        self.cc = shlex.split(cc)
+        self.cache = Path(cache) if cache else None
+        self.jobs = jobs
+        self.context = context
+
+    def _environ(self, name: str) -> str:
+        if self.context is not None:
+            return self.context.env(name) or ""
+        return os.environ.get(name, "")
+
+    def identity(self) -> str:
+        # Identify the toolchain without spawning it: resolved binary, its
+        # stat and the environment the driver consults.
+        binary = shutil.which(self.cc[0]) if self.cc else None
+        parts = [str(Consts.VERSION), *self.cc, os.path.realpath(binary) if binary else ""]
+        if binary:
+            st = os.stat(binary)
+            parts.extend([str(st.st_mtime_ns), str(st.st_size)])
+            if self.context is not None:
+                self.context.depend_on(os.path.realpath(binary))
+        parts.extend(f"{name}={self._environ(name)}" for name in Consts.ENVIRON)
+        return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+    def _load(self) -> Dict[str, Dict[str, Result]]:
+        if self.cache is None:
+            return {}
+        try:
+            return json.loads(self.cache.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def _store(self, entries: Dict[str, Dict[str, Result]]) -> None:
+        if self.cache is None:
+            return
+        self.cache.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.cache.with_name(f"{self.cache.name}.{os.getpid()}")
+        tmp.write_text(json.dumps(entries, indent=1, sort_keys=True))
+        os.replace(tmp, self.cache)
+
+    def run(self, probes: Iterable[Probe]) -> Dict[Probe, Result]:
+        probes = list(dict.fromkeys(probes))
+        entries = self._load()
+        identity = self.identity()
+        known = entries.setdefault(identity, {})
+
+        pending = [probe for probe in probes if probe.key() not in known]
+        if pending:
+            with ThreadPoolExecutor(max_workers=self.jobs or os.cpu_count()) as pool:
+                results = pool.map(lambda probe: probe.run(self.cc), pending)
+                for probe, result in zip(pending, results):
+                    known[probe.key()] = result
+            self._store(entries)
+
+        return {probe: known[probe.key()] for probe in probes}
+
+    def cflags(self, flags: Iterable[str]) -> List[str]:
+        flags = list(flags)
+        results = self.run(CFlag(flag) for flag in flags)
+        return [flag for flag in flags if results[CFlag(flag)]]
+
+    def has_header(self, name: str) -> bool:
+        return bool(self.run([Header(name)])[Header(name)])
+
+    def links(self, name: str, libs: Sequence[str] = ()) -> bool:
+        probe = Function(name, tuple(libs))
+        return bool(self.run([probe])[probe])
+
+    def version(self) -> str:
+        return str(self.run([Version()])[Version()])
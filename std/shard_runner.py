@@ -0,0 +1,155 @@
+# Runs one shard of a test binary for std.testing and merges shard results.
+# Invoked from recipes as a plain script, so it only uses the standard library.
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import List
+
+PASSED = "passed"
+FAILED = "failed"
+OUTPUT_LIMIT = 64 * 1024
+
+
+def fingerprint(binary: str, args: List[str], index: int, total: int) -> str:
+    digest = hashlib.sha256()
+    with open(binary, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    digest.update(json.dumps([args, index, total]).encode())
+    return digest.hexdigest()
+
+
+def args_main(args: argparse.Namespace) -> int:
+    content = json.dumps(args.command)
+    try:
+        with open(args.out) as f:
+            if f.read() == content:
+                return 0
+    except OSError:
+        pass
+    with open(args.out, "w") as f:
+        f.write(content)
+    return 0
+
+
+def shard_main(args: argparse.Namespace) -> int:
+    binary, *binary_args = args.command
+    key = fingerprint(binary, binary_args, args.index, args.total)
+
+    try:
+        with open(args.stamp) as f:
+            previous = json.load(f)
+    except (OSError, ValueError):
+        previous = {}
+
+    if previous.get("key") == key and previous.get("status") == PASSED:
+        previous["cached"] = True
+        with open(args.stamp, "w") as f:
+            json.dump(previous, f)
+        return 0
+
+    env = dict(os.environ)
+    for prefix in ("TEST", "GTEST"):
+        env[f"{prefix}_SHARD_INDEX"] = str(args.index)
+        env[f"{prefix}_TOTAL_SHARDS"] = str(args.total)
+
+    start = time.monotonic()
+    # A bare name such as "t" is the file in the build directory, not a PATH
+    # lookup.
+    done = subprocess.run(
+        [os.path.abspath(binary), *binary_args],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+    )
+    result = {
+        "key": key,
+        "binary": binary,
+        "args": binary_args,
+        "index": args.index,
+        "total": args.total,
+        "status": PASSED if done.returncode == 0 else FAILED,
+        "code": done.returncode,
+        "duration": round(time.monotonic() - start, 3),
+        "cached": False,
+        "output": done.stdout[-OUTPUT_LIMIT:].decode(errors="replace"),
+    }
+    with open(args.stamp, "w") as f:
+        json.dump(result, f)
+    return 0
+
+
+def summary_main(args: argparse.Namespace) -> int:
+    results = []
+    for stamp in args.stamps:
+        with open(stamp) as f:
+            results.append(json.load(f))
+
+    failed = [result for result in results if result["status"] != PASSED]
+    cached = sum(1 for result in results if result["cached"])
+    for result in failed:
+        print(
+            f"FAILED {result['binary']} shard {result['index'] + 1}/{result['total']}"
+            f" (exit {result['code']})",
+            file=sys.stderr,
+        )
+        sys.stderr.write(result["output"])
+
+    # Failed shards are reported first, then dated back to the epoch so make
+    # runs them again next time.
+    for stamp, result in zip(args.stamps, results):
+        if result["status"] != PASSED:
+            os.utime(stamp, (0, 0))
+
+    duration = sum(result["duration"] for result in results)
+    print(
+        f"{len(results) - len(failed)}/{len(results)} shards passed,"
+        f" {cached} cached, {duration:.2f}s"
+    )
+    if failed:
+        return 1
+
+    summary = {
+        "shards": len(results),
+        "cached": cached,
+        "duration": duration,
+        "results": [{k: v for k, v in r.items() if k != "output"} for r in results],
+    }
+    with open(args.out, "w") as f:
+        json.dump(summary, f, indent=1)
+    return 0
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(prog="shard_runner")
+    commands = parser.add_subparsers(dest="command_name", required=True)
+
+    args_file = commands.add_parser("args", help="record test arguments if changed")
+    args_file.add_argument("--out", required=True)
+    args_file.add_argument("command", nargs=argparse.REMAINDER)
+    args_file.set_defaults(run=args_main)
+
+    shard = commands.add_parser("shard", help="run one shard of a test binary")
+    shard.add_argument("--stamp", required=True)
+    shard.add_argument("--index", type=int, required=True)
+    shard.add_argument("--total", type=int, required=True)
+    shard.add_argument("command", nargs=argparse.REMAINDER)
+    shard.set_defaults(run=shard_main)
+
+    summary = commands.add_parser("summary", help="merge shard results")
+    summary.add_argument("--out", required=True)
+    summary.add_argument("stamps", nargs="+")
+    summary.set_defaults(run=summary_main)
+
+    args = parser.parse_args(argv)
+    if getattr(args, "command", None) and args.command[0] == "--":
+        args.command = args.command[1:]
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
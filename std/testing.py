@@ -0,0 +1,107 @@
+from makepy import (
+    Consts as MakeConsts,
+    Context,
+    Info,
+    MakePhonyRule,
+    MakeRule,
+    RefOrStr,
+    Rule,
+    command,
+)
+from dataclasses import dataclass
+from typing import List, Sequence
+import hashlib
+import os
+
+
+class Consts:
+    RUNNER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "shard_runner.py")
+    ARGS = "args"
+    SHARD = "shard"
+    SUMMARY = "summary"
+    FORCE = "makepy-test-args"
+
+
+## Run a test binary in shards with cached results
+
+
+@dataclass
+class RunTestArgs:
+    binary: str
+    out_dir: str
+    python: RefOrStr
+    shards: int = 1
+    args: Sequence[RefOrStr] = ()
+
+
+@dataclass
+class RunTestInfo(Info):
+    files: Sequence[str]
+    shards: Sequence[str]
+    summary: str
+
+
+def run_test_impl(context: Context, args: RunTestArgs) -> RunTestInfo:
+    # Keyed by the whole path so unit/test and integration/test can share an
+    # out_dir.
+    binary = os.path.normpath(args.binary)
+    digest = hashlib.sha1(binary.encode()).hexdigest()[:10]
+    name = f"{os.path.basename(binary)}-{digest}"
+    shards = max(1, args.shards)
+
+    # Rewritten on every run but only touched when the expanded arguments
+    # change, so the stamps below go stale exactly when the arguments do.
+    args_file = f"{args.out_dir}/{name}.args"
+    cmd = command([args.python, Consts.RUNNER, Consts.ARGS, "--out", args_file, "--", *args.args])
+    context.add_rule(MakePhonyRule(name=Consts.FORCE, dependencies=[], commands=[]))
+    rule = MakeRule(
+        name=args_file,
+        dependencies=[Consts.FORCE],
+        commands=[MakeConsts.MKDIR, cmd],
+    )
+    context.add_rule(rule)
+
+    stamps: List[str] = []
+    for index in range(shards):
+        stamp = f"{args.out_dir}/{name}.{index + 1}-of-{shards}.json"
+        cmd = command(
+            [
+                args.python,
+                Consts.RUNNER,
+                Consts.SHARD,
+                "--stamp",
+                stamp,
+                "--index",
+                str(index),
+                "--total",
+                str(shards),
+                "--",
+                args.binary,
+                *args.args,
+            ]
+        )
+        rule = MakeRule(
+            name=stamp,
+            dependencies=[args.binary, args_file],
+            commands=[MakeConsts.MKDIR, cmd],
+        )
+        context.add_rule(rule)
+        stamps.append(stamp)
+
+    summary = f"{args.out_dir}/{name}.summary.json"
+    cmd = command([args.python, Consts.RUNNER, Consts.SUMMARY, "--out", summary, *stamps])
+    rule = MakeRule(
+        name=summary,
+        dependencies=stamps,
+        commands=[cmd],
+    )
+    context.add_rule(rule)
+
+    return RunTestInfo(files=[summary], shards=stamps, summary=summary)
+
+
+def run_test_impl_describe(args: RunTestArgs) -> str:
+    return f"Generating {args.shards} test shard rules for {args.binary}"
+
+
+run_test = Rule(impl=run_test_impl, describe_impl=run_test_impl_describe)
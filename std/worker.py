@@ -0,0 +1,234 @@
+from makepy import (
+    Context,
+    DefaultInfo,
+    Info,
+    MakeRule,
+    RefOrStr,
+    Rule,
+    VariableRef,
+    command,
+)
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Optional, Sequence, Tuple
+import contextlib
+import hashlib
+import importlib
+import importlib.util
+import io
+import json
+import os
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+
+class Consts:
+    CLIENT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker_client.py")
+    IDLE = 2.0
+    TICK = 0.2
+
+
+def socket_path(root: str) -> str:
+    key = hashlib.sha256(f"{root}\0{sys.executable}".encode()).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), f"makepy-worker-{os.getuid()}-{key}.sock")
+
+
+def get_worker(context: Context) -> VariableRef:
+    client = command([sys.executable, "-S", Consts.CLIENT, socket_path(os.getcwd())])
+    return context.variable("PYWORKER", client)
+
+
+## Run a Python callable in the persistent worker pool
+
+
+@dataclass
+class PyActionArgs:
+    in_: Sequence[str]
+    out: str
+    action: str
+    worker: RefOrStr
+    args: Sequence[RefOrStr] = ()
+
+
+def _action_source(action: str) -> str:
+    # Recipes run the action from the build directory, which is the same
+    # directory configure runs in.
+    module = action.partition(":")[0]
+    if os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+    try:
+        spec = importlib.util.find_spec(module)
+    except (ImportError, ValueError):
+        spec = None
+    if spec is None or not spec.has_location or not spec.origin:
+        raise ValueError(f"Cannot find the source of worker action {action}")
+    source = os.path.relpath(spec.origin)
+    return spec.origin if source.startswith(os.pardir) else source
+
+
+def py_action_impl(context: Context, args: PyActionArgs) -> Info:
+    cmd = command([args.worker, args.action, args.out, *args.in_, *args.args])
+
+    # Editing the action's module must rebuild what it produced.
+    rule = MakeRule(
+        name=args.out,
+        dependencies=[*args.in_, _action_source(args.action)],
+        commands=[cmd],
+    )
+    context.add_rule(rule)
+    return DefaultInfo(files=[args.out])
+
+
+def py_action_impl_describe(args: PyActionArgs) -> str:
+    return f"Generating worker rule {args.action} for {args.in_} to {args.out}"
+
+
+py_action = Rule(impl=py_action_impl, describe_impl=py_action_impl_describe)
+
+
+## Server
+
+
+_loaded: Dict[str, int] = {}
+
+
+def _import(name: str):
+    # Pool processes outlive a build, so reload a module edited since.
+    module = importlib.import_module(name)
+    source = getattr(module, "__file__", None)
+    mtime = os.stat(source).st_mtime_ns if source else 0
+    if _loaded.setdefault(name, mtime) != mtime:
+        module = importlib.reload(module)
+        _loaded[name] = mtime
+    return module
+
+
+def _call(action: str, args: Sequence[str], cwd: str) -> Tuple[int, str, str]:
+    if cwd not in sys.path:
+        sys.path.insert(0, cwd)
+    os.chdir(cwd)
+
+    stdout, stderr = io.StringIO(), io.StringIO()
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            module, _, name = action.partition(":")
+            result = getattr(_import(module), name)(*args)
+            code = result if isinstance(result, int) else 0
+        except SystemExit as exit:
+            code = exit.code if isinstance(exit.code, int) else 1
+        except Exception:
+            traceback.print_exc()
+            code = 1
+    return code, stdout.getvalue(), stderr.getvalue()
+
+
+class WorkerServer(socketserver.ThreadingUnixStreamServer):
+    # server_close waits for the handlers, so the pool outlives every request.
+    daemon_threads = False
+
+    def __init__(self, path: str, jobs: Optional[int]):
+        super().__init__(path, WorkerHandler)
+        self.path = path
+        self.inode = os.stat(path).st_ino
+        self.pool = ProcessPoolExecutor(max_workers=jobs)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.closing = False
+        self.last = time.monotonic()
+
+    def process_request(self, request, client_address) -> None:
+        # Counted as active from accept, before the handler thread starts.
+        with self.lock:
+            closing = self.closing
+            if not closing:
+                self.active += 1
+        if closing:
+            # The client sees an empty reply and starts a new worker.
+            self.shutdown_request(request)
+            return
+        super().process_request(request, client_address)
+
+    def process_request_thread(self, request, client_address) -> None:
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            with self.lock:
+                self.active -= 1
+                self.last = time.monotonic()
+
+    def close_if_idle(self, idle: float) -> bool:
+        with self.lock:
+            if self.closing or self.active or time.monotonic() - self.last < idle:
+                return self.closing
+            # Stop taking connections first: new clients fail to connect and
+            # start a fresh worker instead of queueing on a closing one.
+            self.closing = True
+            self.unlink()
+            return True
+
+    def unlink(self) -> None:
+        # Only remove the socket if a newer worker has not replaced it.
+        with contextlib.suppress(OSError):
+            if os.stat(self.path).st_ino == self.inode:
+                os.unlink(self.path)
+
+
+class WorkerHandler(socketserver.StreamRequestHandler):
+    server: WorkerServer
+
+    def handle(self) -> None:
+        request: Dict = json.loads(self.rfile.readline() or b"{}")
+        if request.get("stop"):
+            self.wfile.write(b"{}\n")
+            threading.Thread(target=self.server.shutdown).start()
+            return
+
+        try:
+            future = self.server.pool.submit(
+                _call, request["action"], request["args"], request["cwd"]
+            )
+            code, stdout, stderr = future.result()
+        except Exception:
+            code, stdout, stderr = 1, "", traceback.format_exc()
+
+        reply = {"code": code, "stdout": stdout, "stderr": stderr}
+        self.wfile.write(json.dumps(reply).encode() + b"\n")
+
+
+def serve(path: str, idle: float = Consts.IDLE, jobs: Optional[int] = None) -> None:
+    # The client holds the start-up lock, so a leftover socket is stale.
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(path)
+
+    server = WorkerServer(path, jobs)
+
+    # make has no end-of-build hook: the pool shuts down once it has been
+    # idle for a while, which is right after the last recipe finished.
+    def reaper() -> None:
+        while not server.close_if_idle(idle):
+            time.sleep(Consts.TICK)
+        server.shutdown()
+
+    threading.Thread(target=reaper, daemon=True).start()
+    try:
+        server.serve_forever()
+    finally:
+        server.unlink()
+        server.server_close()
+        server.pool.shutdown()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="std.worker")
+    parser.add_argument("command", choices=["serve"])
+    parser.add_argument("socket")
+    parser.add_argument("--idle", type=float, default=Consts.IDLE)
+    parser.add_argument("-j", "--jobs", type=int)
+    args = parser.parse_args()
+    serve(args.socket, args.idle, args.jobs)
@@ -0,0 +1,88 @@
+# Tiny client for std.worker, run once per recipe line. It only imports what
+# it needs to talk to the worker so each call avoids interpreter start-up
+# work; run it with `python -S`.
+import fcntl
+import json
+import os
+import socket
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STOP = "--stop"
+START_TIMEOUT = 10.0
+
+
+def connect(path: str) -> "socket.socket | None":
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def start(path: str) -> socket.socket:
+    # Serialize start-up so concurrent recipes launch a single server.
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        sock = connect(path)
+        if sock is not None:
+            return sock
+
+        import subprocess
+
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(
+            part for part in (ROOT, env.get("PYTHONPATH", "")) if part
+        )
+        subprocess.Popen(
+            [sys.executable, "-m", "std.worker", "serve", path],
+            env=env,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+
+        deadline = time.monotonic() + START_TIMEOUT
+        while time.monotonic() < deadline:
+            sock = connect(path)
+            if sock is not None:
+                return sock
+            time.sleep(0.01)
+    raise SystemExit(f"makepy worker did not start on {path}")
+
+
+def request(sock: socket.socket, message: dict) -> bytes:
+    with sock, sock.makefile("rwb") as stream:
+        stream.write(json.dumps(message).encode() + b"\n")
+        stream.flush()
+        return stream.readline()
+
+
+def main(argv: "list[str]") -> int:
+    path, action, *args = argv
+    if action == STOP:
+        sock = connect(path)
+        if sock is not None:
+            request(sock, {"stop": True})
+        return 0
+
+    message = {"action": action, "args": args, "cwd": os.getcwd()}
+    line = request(connect(path) or start(path), message)
+    if not line:
+        # The worker went idle and shut down as we connected; start another.
+        line = request(start(path), message)
+    if not line:
+        print("makepy worker closed the connection", file=sys.stderr)
+        return 1
+
+    reply = json.loads(line)
+    sys.stdout.write(reply.get("stdout", ""))
+    sys.stderr.write(reply.get("stderr", ""))
+    return int(reply.get("code", 0))
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))